@@ -0,0 +1,168 @@
+import argparse
+from pathlib import Path
+
+# The heavy modules (bs4, lxml, ruamel.yaml, fontTools) are imported by the
+# subcommands that use them, so that starting the command stays cheap.
+
+CONVERSION_FUNCTS_BY_SUFFIX = {
+    ".azw3": "epub_to_azw3",
+    ".mobi": "epub_to_mobi",
+    ".pdf": "epub_to_pdf",
+}
+
+
+def _read_book_metadata(metadata_path, md_files_dir):
+    from ruamel.yaml import YAML
+
+    with Path(metadata_path).open("rt") as fhand:
+        book_metadata = dict(YAML(typ="safe").load(fhand))
+
+    if "bibliography_paths" in book_metadata:
+        book_metadata["bibliography_paths"] = [
+            Path(path) for path in book_metadata["bibliography_paths"]
+        ]
+    if "citation_style_language_path" in book_metadata:
+        book_metadata["citation_style_language_path"] = Path(
+            book_metadata["citation_style_language_path"]
+        )
+    if "commit_hash" not in book_metadata:
+        from .ebook_from_md import get_commit_hash
+
+        book_metadata["commit_hash"] = get_commit_hash(md_files_dir)
+    return book_metadata
+
+
+def _build(args):
+    from . import ebook_from_md
+
+    kwargs = {
+        "book_metadata": _read_book_metadata(args.metadata_path, args.md_files_dir),
+        "md_files_dir": args.md_files_dir,
+        "output_path": args.output_path,
+        "cover_image_path": args.cover_image_path,
+        "chapters_to_exclude": set(args.chapters_to_exclude),
+        "number_sections": args.number_sections,
+        "toc_depth": args.toc_depth,
+        "images_dir": args.images_dir,
+        "images_dir_path_in_md_files": args.images_dir_path_in_md_files,
+        "workspace_dir": args.workspace_dir,
+    }
+    if args.command == "build-epub":
+        ebook_from_md.build_epub(toc=args.toc, **kwargs)
+    else:
+        ebook_from_md.build_web(**kwargs)
+
+
+def _conversion_out_path(value):
+    path = Path(value)
+    if path.suffix.lower() not in CONVERSION_FUNCTS_BY_SUFFIX:
+        raise argparse.ArgumentTypeError(
+            f"unknown output format, it should be one of {', '.join(CONVERSION_FUNCTS_BY_SUFFIX)}, but it is: {path.suffix}"
+        )
+    return path
+
+
+def _convert(args):
+    from . import format_transformations
+
+    funct_name = CONVERSION_FUNCTS_BY_SUFFIX[args.out_path.suffix.lower()]
+    getattr(format_transformations, funct_name)(args.epub_path, args.out_path)
+
+
+def _move_notes(args):
+    from .move_notes import move_notes_from_each_chapter_to_notes_chapter
+
+    move_notes_from_each_chapter_to_notes_chapter(
+        in_epub_path=args.in_epub_path,
+        out_epub_path=args.out_epub_path,
+        bibliography_chapter_id=args.bibliography_chapter_id,
+        notes_chapter_id=args.notes_chapter_id,
+        pretty_html=not args.compact,
+        minify=args.minify,
+    )
+
+
+def _subset_fonts(args):
+    from .move_notes import subset_epub_fonts
+
+    subset_epub_fonts(args.in_epub_path, args.out_epub_path, cache_path=args.cache_path)
+
+
+def _add_build_args(parser):
+    parser.add_argument("metadata_path", type=Path, help="YAML file with the book metadata")
+    parser.add_argument("md_files_dir", type=Path)
+    parser.add_argument("output_path", type=Path)
+    parser.add_argument("--cover-image", dest="cover_image_path", type=Path)
+    parser.add_argument(
+        "--exclude-chapter", dest="chapters_to_exclude", action="append", default=[]
+    )
+    parser.add_argument(
+        "--no-number-sections", dest="number_sections", action="store_false"
+    )
+    parser.add_argument("--toc-depth", type=int, default=1)
+    parser.add_argument("--images-dir", type=Path)
+    parser.add_argument("--images-dir-path-in-md-files", type=Path)
+    parser.add_argument(
+        "--workspace-dir",
+        type=Path,
+        help="persistent directory to keep the bookdown caches between builds",
+    )
+
+
+def _create_parser():
+    parser = argparse.ArgumentParser(
+        prog="ebook-building",
+        description="ebook creation from a directory with markdown files",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_epub_parser = subparsers.add_parser("build-epub", help="build an epub")
+    _add_build_args(build_epub_parser)
+    build_epub_parser.add_argument("--no-toc", dest="toc", action="store_false")
+    build_epub_parser.set_defaults(funct=_build)
+
+    build_web_parser = subparsers.add_parser("build-web", help="build a web site")
+    _add_build_args(build_web_parser)
+    build_web_parser.set_defaults(funct=_build)
+
+    convert_parser = subparsers.add_parser(
+        "convert", help="convert an epub to azw3, mobi or pdf using calibre"
+    )
+    convert_parser.add_argument("epub_path", type=Path)
+    convert_parser.add_argument("out_path", type=_conversion_out_path)
+    convert_parser.set_defaults(funct=_convert)
+
+    move_notes_parser = subparsers.add_parser(
+        "move-notes",
+        help="move the footnotes and the bibliography entries out of each chapter into the notes and bibliography chapters",
+    )
+    move_notes_parser.add_argument("in_epub_path", type=Path)
+    move_notes_parser.add_argument("out_epub_path", type=Path)
+    move_notes_parser.add_argument("--bibliography-chapter-id", default="bibliografia")
+    move_notes_parser.add_argument("--notes-chapter-id", default="notas")
+    move_notes_parser.add_argument(
+        "--compact", action="store_true", help="do not prettify the modified html"
+    )
+    move_notes_parser.add_argument(
+        "--minify", action="store_true", help="minify the xhtml and css files"
+    )
+    move_notes_parser.set_defaults(funct=_move_notes)
+
+    subset_fonts_parser = subparsers.add_parser(
+        "subset-fonts", help="subset the embedded fonts to the used characters"
+    )
+    subset_fonts_parser.add_argument("in_epub_path", type=Path)
+    subset_fonts_parser.add_argument("out_epub_path", type=Path)
+    subset_fonts_parser.add_argument("--cache-path", type=Path)
+    subset_fonts_parser.set_defaults(funct=_subset_fonts)
+    return parser
+
+
+def main(argv=None):
+    parser = _create_parser()
+    args = parser.parse_args(argv)
+    args.funct(args)
+
+
+if __name__ == "__main__":
+    main()
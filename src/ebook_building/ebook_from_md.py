@@ -1,16 +1,17 @@
-from asyncio import subprocess
+from contextlib import contextmanager
 from datetime import datetime
+import io
+import os
 import shutil
 from subprocess import run, CalledProcessError
 import tempfile
 from pathlib import Path
 import zipfile
 
-from ruamel.yaml import YAML
-
 BOOKDOWN_INDEX_RMD_FNAME = "index.Rmd"
 BOOKDOWN_YML_FNAME = "_bookdown.yml"
 MK_SUFFIX = ".md"
+WORKSPACE_LOCK_FNAME = ".workspace.lock"
 
 R_COMPILE_SCRIPT_EPUB = """
 setwd("{working_dir}")
@@ -95,6 +96,100 @@ def install_r_packages(package_names):
         run_r_command(r_cmd)
 
 
+def _write_if_changed(path, text):
+    # files are not touched if unchanged to keep the bookdown and knitr caches
+    if path.exists() and path.read_text() == text:
+        return
+    path.write_text(text)
+
+
+def _remove_path(path):
+    if path.is_dir() and not path.is_symlink():
+        shutil.rmtree(path)
+    else:
+        path.unlink()
+
+
+def _copy_if_changed(src_path, dst_path):
+    src_stat = src_path.stat()
+    if dst_path.is_dir() and not dst_path.is_symlink():
+        # it was a directory in a previous build
+        shutil.rmtree(dst_path)
+    if dst_path.exists():
+        dst_stat = dst_path.stat()
+        if (
+            dst_stat.st_size == src_stat.st_size
+            and dst_stat.st_mtime_ns == src_stat.st_mtime_ns
+        ):
+            return
+    shutil.copy2(src_path, dst_path)
+
+
+def _is_kept(path, paths_to_keep):
+    for path_to_keep in paths_to_keep:
+        if (
+            path == path_to_keep
+            or path in path_to_keep.parents
+            or path_to_keep in path.parents
+        ):
+            return True
+    return False
+
+
+def _sync_dir(src_dir, dst_dir, paths_to_keep=None):
+    if paths_to_keep is None:
+        paths_to_keep = []
+    src_dir = Path(src_dir)
+    dst_dir = Path(dst_dir)
+    dst_dir.mkdir(parents=True, exist_ok=True)
+
+    # symlinked directories are followed, as shutil.copytree does
+    for dir_path, dir_names, file_names in os.walk(src_dir, followlinks=True):
+        dir_path = Path(dir_path)
+        this_dst_dir = dst_dir / dir_path.relative_to(src_dir)
+        for dir_name in dir_names:
+            dst_path = this_dst_dir / dir_name
+            if dst_path.is_symlink() or (dst_path.exists() and not dst_path.is_dir()):
+                # it was a file in a previous build
+                dst_path.unlink()
+            dst_path.mkdir(exist_ok=True)
+        for file_name in file_names:
+            _copy_if_changed(dir_path / file_name, this_dst_dir / file_name)
+
+    for dir_path, dir_names, file_names in os.walk(dst_dir, topdown=False):
+        dir_path = Path(dir_path)
+        this_src_dir = src_dir / dir_path.relative_to(dst_dir)
+        for name in file_names + dir_names:
+            dst_path = dir_path / name
+            if (this_src_dir / name).exists() or _is_kept(dst_path, paths_to_keep):
+                continue
+            _remove_path(dst_path)
+
+
+@contextmanager
+def _working_dir(workspace_dir=None):
+    if workspace_dir is None:
+        with tempfile.TemporaryDirectory() as working_dir_bfpath:
+            try:
+                # it looks that with python 3.10 with TemporaryDirectory has changed its behaviour
+                working_dir_path = Path(working_dir_bfpath.decode())
+            except AttributeError:
+                working_dir_path = Path(working_dir_bfpath)
+            yield working_dir_path
+        return
+
+    import fcntl
+
+    working_dir_path = Path(workspace_dir).absolute()
+    working_dir_path.mkdir(parents=True, exist_ok=True)
+    with (working_dir_path / WORKSPACE_LOCK_FNAME).open("w") as lock_fhand:
+        fcntl.flock(lock_fhand, fcntl.LOCK_EX)
+        try:
+            yield working_dir_path
+        finally:
+            fcntl.flock(lock_fhand, fcntl.LOCK_UN)
+
+
 def _create_bookdown_index_rmd(index_rmd_path, book_metadata):
 
     METADATA_FIELDS = [
@@ -116,12 +211,14 @@ def _create_bookdown_index_rmd(index_rmd_path, book_metadata):
     data["link-citations"] = "yes"
     data["language"] = {"ui": {"chapter_name": ""}}
 
-    fhand = index_rmd_path.open("wt")
+    from ruamel.yaml import YAML
+
+    fhand = io.StringIO()
     fhand.write("---\n")
     yaml = YAML()
     yaml.dump(data, fhand)
     fhand.write("\n---\n")
-    fhand.flush()
+    _write_if_changed(index_rmd_path, fhand.getvalue())
 
 
 def _get_chapter_md_paths(md_files_dir, chapters_to_exclude):
@@ -152,12 +249,14 @@ def _get_chapter_md_paths(md_files_dir, chapters_to_exclude):
 
 
 def _create_bookdown_yml(bookdown_yml_path, chapter_paths):
+    from ruamel.yaml import YAML
+
     data = {"rmd_files": [str(path) for path in chapter_paths]}
 
     yaml = YAML()
-    fhand = bookdown_yml_path.open("wt")
+    fhand = io.StringIO()
     yaml.dump(data, fhand)
-    fhand.flush()
+    _write_if_changed(bookdown_yml_path, fhand.getvalue())
 
 
 def _create_front_matter_chapter(metadata, front_matter_path):
@@ -178,9 +277,7 @@ def _create_front_matter_chapter(metadata, front_matter_path):
         year=now.year,
         copyright_date_str=copyright_date_str,
     )
-    fhand = front_matter_path.open("wt")
-    fhand.write(to_write)
-    fhand.flush()
+    _write_if_changed(front_matter_path, to_write)
     return
 
 
@@ -223,6 +320,7 @@ def _build_web_or_epub(
     toc_depth=1,
     images_dir=None,
     images_dir_path_in_md_files=None,
+    workspace_dir=None,
 ):
     install_r_packages(["bookdown"])
 
@@ -231,34 +329,21 @@ def _build_web_or_epub(
 
     book_metadata = book_metadata.copy()
 
-    with tempfile.TemporaryDirectory() as working_dir_bfpath:
-        try:
-            # it looks that with python 3.10 with TemporaryDirectory has changed its behaviour
-            working_dir_path = Path(working_dir_bfpath.decode())
-        except AttributeError:
-            working_dir_path = Path(working_dir_bfpath)
-
+    with _working_dir(workspace_dir) as working_dir_path:
         if "bibliography_paths" in book_metadata:
-            bibliography_tmp_files = []
-            for path in book_metadata["bibliography_paths"]:
-                tmp_bib_file = tempfile.NamedTemporaryFile(
-                    dir=working_dir_path,
-                    suffix=f"_{Path(path.name).name}",
-                    delete=False,
-                )
-                bibliography_tmp_files.append(tmp_bib_file.name)
-                shutil.copy(path, tmp_bib_file.name)
-                tmp_bib_file.close()
-            book_metadata["bibliography"] = bibliography_tmp_files
+            bibliography_paths = []
+            for idx, path in enumerate(book_metadata["bibliography_paths"]):
+                working_bib_path = working_dir_path / f"bib_{idx}_{Path(path).name}"
+                _copy_if_changed(Path(path), working_bib_path)
+                bibliography_paths.append(str(working_bib_path))
+            book_metadata["bibliography"] = bibliography_paths
             del book_metadata["bibliography_paths"]
-        else:
-            bibliography_tmp_files = None
 
         if "citation_style_language_path" in book_metadata:
             orig_path = book_metadata["citation_style_language_path"]
             fname = orig_path.name
             new_path = working_dir_path / fname
-            shutil.copy(orig_path, new_path)
+            _copy_if_changed(orig_path, new_path)
             book_metadata["csl"] = fname
             del book_metadata["citation_style_language_path"]
 
@@ -266,13 +351,24 @@ def _build_web_or_epub(
         _create_bookdown_index_rmd(index_rmd_path, book_metadata)
 
         working_md_chapters_path = working_dir_path / "chapters"
-        shutil.copytree(md_files_dir, working_md_chapters_path)
-
+        front_matter_path = working_md_chapters_path / "front_matter.md"
         if images_dir:
             working_dir_images_path = working_dir_path / images_dir_path_in_md_files
-            shutil.copytree(images_dir, working_dir_images_path)
 
-        front_matter_path = working_md_chapters_path / "front_matter.md"
+        if workspace_dir is None:
+            shutil.copytree(md_files_dir, working_md_chapters_path)
+            if images_dir:
+                shutil.copytree(images_dir, working_dir_images_path)
+        else:
+            paths_to_keep = [front_matter_path]
+            if images_dir:
+                paths_to_keep.append(working_dir_images_path)
+            _sync_dir(
+                md_files_dir, working_md_chapters_path, paths_to_keep=paths_to_keep
+            )
+            if images_dir:
+                _sync_dir(images_dir, working_dir_images_path)
+
         _create_front_matter_chapter(book_metadata, front_matter_path)
 
         chapter_paths = [index_rmd_path]
@@ -296,12 +392,9 @@ def _build_web_or_epub(
             renderer_params["toc"] = toc
 
         if cover_image_path:
-            tmp_cover_image_path = tempfile.NamedTemporaryFile(
-                dir=working_dir_path, suffix=cover_image_path.suffix, delete=False
-            )
-            shutil.copy(cover_image_path, tmp_cover_image_path.name)
-            tmp_cover_image_path.close()
-            renderer_params["cover_image"] = f"file.path('{tmp_cover_image_path.name}')"
+            working_cover_image_path = working_dir_path / f"cover{cover_image_path.suffix}"
+            _copy_if_changed(cover_image_path, working_cover_image_path)
+            renderer_params["cover_image"] = f"file.path('{working_cover_image_path}')"
 
         if output_type == "epub":
             render_funct = "bookdown::epub_book"
@@ -331,8 +424,6 @@ def _build_web_or_epub(
                 shutil.rmtree(output_path)
             shutil.move(tmp_web_path, output_path)
 
-        del bibliography_tmp_files
-
 
 def build_web(
     book_metadata,
@@ -344,6 +435,7 @@ def build_web(
     toc_depth=1,
     images_dir=None,
     images_dir_path_in_md_files=None,
+    workspace_dir=None,
 ):
     _build_web_or_epub(
         "web",
@@ -357,6 +449,7 @@ def build_web(
         toc_depth=toc_depth,
         images_dir=images_dir,
         images_dir_path_in_md_files=images_dir_path_in_md_files,
+        workspace_dir=workspace_dir,
     )
 
 
@@ -371,6 +464,7 @@ def build_epub(
     toc_depth=1,
     images_dir=None,
     images_dir_path_in_md_files=None,
+    workspace_dir=None,
 ):
 
     _build_web_or_epub(
@@ -385,6 +479,7 @@ def build_epub(
         toc_depth=toc_depth,
         images_dir=images_dir,
         images_dir_path_in_md_files=images_dir_path_in_md_files,
+        workspace_dir=workspace_dir,
     )
 
 
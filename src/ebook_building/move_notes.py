@@ -1,18 +1,43 @@
 
 
+from abc import ABC, abstractmethod
 from pathlib import Path
+import hashlib
+import importlib.util
+import io
+import json
+import posixpath
+import string
 import zipfile
 import re
 
-from bs4 import BeautifulSoup
-
-try:
-    from rich import print
-except ImportError:
-    pass
+from bs4 import BeautifulSoup, NavigableString
 
 FOOTNOTES_SECTION_CLASS = 'footnotes footnotes-end-of-document'
 FOOTNOTE_ANCHOR_CLASS = 'footnote-ref'
+CITATION_ANCHOR_ROLE = 'doc-biblioref'
+CITATION_ID_PREFIX = 'ref-'
+BIBLIOGRAPHY_ENTRY_CLASS = 'csl-entry'
+BIBLIOGRAPHY_DIV_ID = 'refs'
+FONT_SUFFIXES = ('.ttf', '.otf', '.woff', '.woff2')
+CSS_SUFFIX = '.css'
+# html and css only collapse these, not the unicode spaces like &nbsp;
+ASCII_WHITESPACE_RE = r'[ \t\n\r\f]+'
+CSS_PROPERTIES_WITH_TEXT = ('content', 'quotes')
+CSS_TOKEN_RE = re.compile(r'''(?P<comment>/\*.*?\*/)'''
+                          r'''|(?P<string>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')'''
+                          r'''|(?P<url>url\(\s*(?:"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*'|[^)]*)\s*\))''',
+                          re.DOTALL | re.IGNORECASE)
+# decimal, alpha, roman and bullet list markers
+LIST_MARKER_CHARACTERS = '0123456789.)•◦▪■' + string.ascii_letters
+WHITESPACE_PRESERVING_TAGS = {'pre', 'code', 'textarea', 'script', 'style'}
+# whitespace is only removed between these, any other tag might render it
+BLOCK_TAGS = {'[document]', 'html', 'head', 'title', 'meta', 'link', 'body',
+              'section', 'article', 'aside', 'nav', 'header', 'footer', 'main',
+              'div', 'p', 'blockquote', 'pre', 'figure', 'figcaption', 'hr',
+              'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'ul', 'ol', 'li', 'dl', 'dt',
+              'dd', 'table', 'caption', 'colgroup', 'col', 'thead', 'tbody',
+              'tfoot', 'tr', 'th', 'td'}
 
 
 def _is_html(data):
@@ -61,6 +86,99 @@ def _data_to_bytes(data, encoding=None):
     return data.encode(encoding)
 
 
+def _serialize_soup(soup, pretty=True, formatter='minimal'):
+    if pretty:
+        return soup.prettify(formatter=formatter)
+    else:
+        return soup.decode(formatter=formatter)
+
+
+def _is_block(element):
+    return getattr(element, 'name', None) in BLOCK_TAGS
+
+
+def _minify_html_soup(soup):
+    for string in list(soup.find_all(string=True)):
+        # comments, doctypes and CDATA are NavigableString subclasses
+        if type(string) is not NavigableString:
+            continue
+        if any(parent.name in WHITESPACE_PRESERVING_TAGS for parent in string.parents):
+            continue
+        if not re.fullmatch(ASCII_WHITESPACE_RE, string):
+            string.replace_with(re.sub(ASCII_WHITESPACE_RE, ' ', string))
+            continue
+        # whitespace between two block elements is not rendered,
+        # but between inline elements is a space
+        siblings = (string.previous_sibling, string.next_sibling)
+        if all(_is_block(string.parent if sibling is None else sibling)
+               for sibling in siblings):
+            string.extract()
+        else:
+            string.replace_with(' ')
+
+
+def _tokenize_css(css):
+    # splits the css in (kind, text) tokens, kind being code, comment,
+    # string or url, so that the strings and urls can be left untouched
+    tokens = []
+    pos = 0
+    for match in CSS_TOKEN_RE.finditer(css):
+        if match.start() > pos:
+            tokens.append(('code', css[pos:match.start()]))
+        tokens.append((match.lastgroup, match.group()))
+        pos = match.end()
+    if pos < len(css):
+        tokens.append(('code', css[pos:]))
+    return tokens
+
+
+def _unescape_css_string(css_string):
+    def _unescape(match):
+        if match.group(1):
+            return chr(int(match.group(1), 16))
+        if match.group(2) == '\n':
+            return ''
+        return match.group(2)
+
+    return re.sub(r'\\([0-9a-fA-F]{1,6})[ \t\n\r\f]?|\\(.)', _unescape,
+                  css_string[1:-1], flags=re.DOTALL)
+
+
+def _get_css_text_characters(css):
+    characters = set()
+    declaration = ''
+    for kind, text in _tokenize_css(css):
+        if kind == 'code':
+            declaration = re.split('[;{}]', declaration + text)[-1]
+        elif kind == 'string':
+            property_ = declaration.split(':')[0].strip().lower()
+            if property_ in CSS_PROPERTIES_WITH_TEXT:
+                characters.update(_unescape_css_string(text))
+    return characters
+
+
+def _minify_css(css):
+    # the strings and urls are kept aside so that they are not modified
+    code = ''
+    kept_tokens = []
+    for kind, text in _tokenize_css(css):
+        if kind == 'code':
+            code += text
+        elif kind == 'comment':
+            # comments separate tokens, e.g. 1px/**/2px
+            code += ' '
+        else:
+            code += f'\x00{len(kept_tokens)}\x00'
+            kept_tokens.append(text)
+
+    code = re.sub(ASCII_WHITESPACE_RE, ' ', code)
+    code = re.sub(r' ?([{};,>]) ?', r'\1', code)
+    code = re.sub(r' ?: ?(?=[^{}]*;|[^{}]*})', ':', code)
+    code = code.replace(';}', '}')
+    return re.sub('\x00([0-9]+)\x00', lambda match: kept_tokens[int(match.group(1))],
+                  code.strip())
+
+
 def _is_html_with_encoding(data):
     if not _is_html(data):
         return False
@@ -71,6 +189,38 @@ def _is_html_with_encoding(data):
     return True
 
 
+def _get_title_from_soup(soup):
+    h1 = soup.h1
+
+    span = h1.span
+    if span:
+        title = str(h1.contents[-1].string)
+    else:
+        title = str(h1.string)
+    title = title.strip()
+    return title
+
+
+def _get_the_h1(soup):
+    h1s = soup.find_all('h1')
+    if not h1s:
+        raise RuntimeError('No H1')
+    if len(h1s) > 1:
+        raise RuntimeError('More than one H1')
+    return h1s[0]
+
+
+def _split_href(href):
+    if '#' not in href:
+        return href, None
+    path, fragment = href.split('#', 1)
+    return path, fragment
+
+
+def _is_internal_href(href):
+    return not re.match(r'^[a-zA-Z][a-zA-Z0-9+.-]*:', href)
+
+
 class Content:
     def __init__(self, info, data):
         self.info = info
@@ -105,9 +255,10 @@ class Content:
 
 class BookSection(Content):
 
-    def __init__(self, info, data):
+    def __init__(self, info, data, pretty=True):
         super().__init__(info, data)
         self.data = _data_to_str(data)
+        self.pretty = pretty
 
     @property
     def id(self):
@@ -123,58 +274,22 @@ class BookSection(Content):
     @property
     def title(self):
         soup = BeautifulSoup(self.data, "lxml")
-        h1 = soup.h1
-
-        span = h1.span
-        if span:
-            title = str(h1.contents[-1].string)
-        else:
-            title = str(h1.string)
-        title = title.strip()
-        return title
+        return _get_title_from_soup(soup)
  
-    def remove_and_return_footnotes_section(self):
+    @property
+    def text(self):
         soup = BeautifulSoup(self.data, "lxml")
+        return soup.get_text()
 
-        bs_tags = soup.find_all(class_=FOOTNOTES_SECTION_CLASS)
-
-        if not bs_tags:
-            raise RuntimeError('No footnote seccion')
-        if len(bs_tags) != 1:
-            raise RuntimeError('Only one footnote section expected')
-        assert bs_tags[0].name == 'section'
-        section = bs_tags[0]
-
-        section.extract()
-        #section.replace_with('')
-
-        self.data = soup.prettify()
-
-        return section
-
-    def modify_footnote_links(self, global_footnote_count, path_to_notes_chapter):
+    def minify(self):
         soup = BeautifulSoup(self.data, "lxml")
-
-        footnotes_info = []
-        for anchor_tag in soup.find_all('a', class_=FOOTNOTE_ANCHOR_CLASS):
-            new_id = 'fn' + str(global_footnote_count + 1)
-            footnote = {'old_id': anchor_tag.attrs['href'].split('#')[-1],
-                        'new_id': new_id}
-            reference_to_footnote_in_text = {'id': anchor_tag.attrs['id']}
-            footnotes_info.append({'footnote': footnote,
-                                   'reference_to_footnote_in_text': reference_to_footnote_in_text})
-            global_footnote_count += 1
-
-            new_href = f'{path_to_notes_chapter}#{new_id}'
-            anchor_tag.attrs['href'] = new_href
-
-        self.data = soup.prettify()
-
-        return footnotes_info, global_footnote_count
+        _minify_html_soup(soup)
+        self.data = _serialize_soup(soup, pretty=False)
 
 
 class _Epub:
-    def __init__(self, in_path):
+    def __init__(self, in_path, pretty_html=True):
+        self.pretty_html = pretty_html
         self.contents = []
         self._sections_by_id = {}
 
@@ -189,7 +304,7 @@ class _Epub:
             content = None
             if _is_html_with_encoding(data):
                 try:
-                    content = BookSection(info, data)
+                    content = BookSection(info, data, pretty=self.pretty_html)
                 except RuntimeError:
                     pass
 
@@ -212,13 +327,103 @@ class _Epub:
     def get_section_by_id(self, id):
         return self._sections_by_id[id]
 
+    @property
+    def sections(self):
+        return [content for content in self.contents if isinstance(content, BookSection)]
+
+    @property
+    def stylesheets(self):
+        return [content for content in self.contents
+                if content.absolute_path.lower().endswith(CSS_SUFFIX)]
+
+    def minify(self):
+        for section in self.sections:
+            section.minify()
+        for stylesheet in self.stylesheets:
+            encoding = 'utf-8'
+            css = _data_to_str(stylesheet.data, encoding=encoding)
+            stylesheet.data = _data_to_bytes(_minify_css(css), encoding=encoding)
+
+    @property
+    def fonts(self):
+        return [content for content in self.contents
+                if content.absolute_path.lower().endswith(FONT_SUFFIXES)]
+
+    def _get_texts_digest(self):
+        hash_ = hashlib.sha256()
+        for section in self.sections:
+            hash_.update(section.data.encode())
+        for stylesheet in self.stylesheets:
+            hash_.update(_data_to_bytes(stylesheet.data, encoding='utf-8'))
+        return hash_.hexdigest()
+
+    def collect_used_characters(self, cache_path=None):
+        # the scan parses every section, so we store its result with a digest
+        # of the sections, unchanged books can reuse it in the next build
+        digest = self._get_texts_digest()
+        if cache_path is not None and Path(cache_path).exists():
+            cache = json.loads(Path(cache_path).read_text())
+            if cache.get('digest') == digest:
+                return set(cache['characters'])
+
+        characters = set(LIST_MARKER_CHARACTERS)
+        for section in self.sections:
+            characters.update(section.text)
+        # glyphs generated by the css, e.g. ::before {content: "\2192"}
+        for stylesheet in self.stylesheets:
+            css = _data_to_str(stylesheet.data, encoding='utf-8')
+            characters.update(_get_css_text_characters(css))
+        # CSS might change the case, e.g. text-transform: uppercase
+        characters.update(''.join(characters).upper())
+        characters.update(''.join(characters).lower())
+        characters.discard('\n')
+        characters.add(' ')
+
+        if cache_path is not None:
+            cache = {'digest': digest, 'characters': sorted(characters)}
+            Path(cache_path).write_text(json.dumps(cache))
+        return characters
+
+    def subset_fonts(self, cache_path=None):
+        fonts = self.fonts
+        if not fonts:
+            return
+
+        try:
+            from fontTools import subset
+            from fontTools.ttLib import TTFont
+        except ImportError:
+            raise RuntimeError('fontTools is required to subset the fonts')
+        # fontTools needs brotli to write woff2 fonts
+        if (any(font.absolute_path.lower().endswith('.woff2') for font in fonts)
+                and importlib.util.find_spec('brotli') is None):
+            raise RuntimeError('brotli is required to subset woff2 fonts')
+
+        characters = self.collect_used_characters(cache_path=cache_path)
+
+        options = subset.Options()
+        options.name_IDs = ['*']
+        options.name_languages = ['*']
+        options.notdef_outline = True
+        options.layout_features = ['*']
+        for content in fonts:
+            font = TTFont(io.BytesIO(content.data))
+            options.flavor = font.flavor
+            subsetter = subset.Subsetter(options=options)
+            subsetter.populate(text=''.join(characters))
+            subsetter.subset(font)
+            out_fhand = io.BytesIO()
+            font.save(out_fhand)
+            content.data = out_fhand.getvalue()
+
 
 class Epub(_Epub):
     
-    def __init__(self, in_path, bibliography_chapter_id, notes_chapter_id):
+    def __init__(self, in_path, bibliography_chapter_id, notes_chapter_id,
+                 pretty_html=True):
         self.bibliography_chapter_id = bibliography_chapter_id
         self.notes_chapter_id = notes_chapter_id
-        super().__init__(in_path=in_path)
+        super().__init__(in_path=in_path, pretty_html=pretty_html)
 
     @property
     def bibliography_chapter(self):
@@ -228,81 +433,296 @@ class Epub(_Epub):
     def notes_chapter(self):
         return self.get_section_by_id(self.notes_chapter_id)
 
-    def _modify_footnotes_id_and_backlinks(self, footnote_section, chapter,
-                                           info_about_footnotes_in_chapter,
-                                           footnotes_chapter):
-        footnotes_in_chapter_by_old_id = {}
-        for info in info_about_footnotes_in_chapter:
-            old_id = info['footnote']['old_id']
-            footnotes_in_chapter_by_old_id[old_id] = info
-
-        for li in footnote_section.find_all('li'):
-            old_footnote_id = li.attrs['id']
-            footnote_in_chapter_info = footnotes_in_chapter_by_old_id[old_footnote_id]
-            li.attrs['id'] = footnote_in_chapter_info['footnote']['new_id']
-
-            back_to_chapter_anchor = li.find_all('a', class_='footnote-back')[0]
-            new_back_href = chapter.path_from(footnotes_chapter) + '#' + footnote_in_chapter_info['reference_to_footnote_in_text']['id']
-            back_to_chapter_anchor.attrs['href'] = new_back_href
-
-    def _appennd_notes(self, notes_chapter, chapter_footnotes):
-        soup = BeautifulSoup(notes_chapter.data, "lxml")
-
-        h1s = soup.find_all('h1')
-        if not h1s:
-            raise RuntimeError('No H1')
-        if len(h1s) > 1:
-            raise RecursionError('More than one H1')
-        h1 = h1s[0]
-
-        notes_html = ''
-        for res in chapter_footnotes:
-            chapter = res['chapter']
-            footnotes = res['footnotes']
-            info_about_footnotes_in_chapter = res['info_about_footnotes_in_chapter']
-            notes_html += f'<h2>{chapter.title}</h2>\n'
-            self._modify_footnotes_id_and_backlinks(footnotes,
-                                                    chapter,
-                                                    info_about_footnotes_in_chapter,
-                                                    notes_chapter)
-            notes_html += str(footnotes)
-            notes_html += '\n'
-
-        h1.insert_after(notes_html)
-        notes_chapter.data = soup.prettify(formatter=None)
+    def _get_default_anchor_rewrite_rules(self):
+        rules = [FootnotesRule(self.notes_chapter)]
+        if self.bibliography_chapter_id in self._sections_by_id:
+            rules.append(CitationsRule(self.bibliography_chapter))
+        return rules
+
+    def rewrite_anchors(self, rules=None):
+        if rules is None:
+            rules = self._get_default_anchor_rewrite_rules()
+        AnchorRewriter(self, rules).run()
 
     def collect_footnotes_in_footnotes_chapter(self):
-        notes_chapter = self.notes_chapter
+        self.rewrite_anchors(rules=[FootnotesRule(self.notes_chapter)])
+
+
+class AnchorRewriteRule(ABC):
+    # A rule can take out parts of a section before its ids are registered,
+    # rewrite the anchors it matches and, once every section has been
+    # processed, add the collected elements to their destination chapter.
+
+    def prepare_section(self, soup, section, rewriter):
+        pass
+
+    @abstractmethod
+    def matches(self, anchor):
+        pass
+
+    @abstractmethod
+    def rewrite(self, anchor, section, rewriter):
+        pass
+
+    def finish(self, rewriter):
+        pass
 
-        chapters_with_footnotes = []
-        global_footnote_count = 0
-        for chapter in self._sections_by_id.values():
-            try:
-                chapter_footnotes = chapter.remove_and_return_footnotes_section()
-            except RuntimeError:
+
+class FootnotesRule(AnchorRewriteRule):
+    def __init__(self, notes_chapter):
+        self.notes_chapter = notes_chapter
+        self._global_footnote_count = 0
+        self._footnotes_by_chapter = {}
+
+    def prepare_section(self, soup, section, rewriter):
+        bs_tags = soup.find_all(class_=FOOTNOTES_SECTION_CLASS)
+        if not bs_tags:
+            return
+        if len(bs_tags) != 1:
+            raise RuntimeError('Only one footnote section expected')
+        assert bs_tags[0].name == 'section'
+        footnotes = bs_tags[0]
+        footnotes.extract()
+        rewriter.set_modified(section)
+        self._footnotes_by_chapter[section] = {'footnotes': footnotes,
+                                               'title': _get_title_from_soup(soup),
+                                               'new_ids_by_old_id': {}}
+        # the backlinks, citations and cross references in the notes are
+        # resolved from their chapter
+        rewriter.relocate(footnotes, section, self.notes_chapter)
+
+    def matches(self, anchor):
+        return FOOTNOTE_ANCHOR_CLASS in anchor.get('class', [])
+
+    def rewrite(self, anchor, section, rewriter):
+        if section not in self._footnotes_by_chapter:
+            return
+        self._global_footnote_count += 1
+        new_id = 'fn' + str(self._global_footnote_count)
+        old_id = _split_href(anchor.attrs['href'])[1]
+        self._footnotes_by_chapter[section]['new_ids_by_old_id'][old_id] = new_id
+        rewriter.add_link(anchor, section, target_id=new_id,
+                          target_section=self.notes_chapter)
+
+    def finish(self, rewriter):
+        if not self._footnotes_by_chapter:
+            return
+        notes_chapter = self.notes_chapter
+        soup = rewriter.get_soup(notes_chapter)
+        last_element = _get_the_h1(soup)
+
+        for chapter_footnotes in self._footnotes_by_chapter.values():
+            footnotes = chapter_footnotes['footnotes']
+            new_ids_by_old_id = chapter_footnotes['new_ids_by_old_id']
+            for li in footnotes.find_all('li'):
+                new_id = new_ids_by_old_id[li.attrs['id']]
+                li.attrs['id'] = new_id
+                rewriter.register_id(new_id, notes_chapter)
+
+            h2 = soup.new_tag('h2')
+            h2.string = chapter_footnotes['title']
+            last_element.insert_after(h2)
+            h2.insert_after(footnotes)
+            last_element = footnotes
+        rewriter.set_modified(notes_chapter)
+
+
+class CitationsRule(AnchorRewriteRule):
+    def __init__(self, bibliography_chapter):
+        self.bibliography_chapter = bibliography_chapter
+        self._entries = []
+
+    def prepare_section(self, soup, section, rewriter):
+        if section is self.bibliography_chapter:
+            return
+        entries = soup.find_all(class_=BIBLIOGRAPHY_ENTRY_CLASS)
+        for entry in entries:
+            self._entries.append(entry.extract())
+        refs_div = soup.find(id=BIBLIOGRAPHY_DIV_ID)
+        if refs_div is not None and not refs_div.get_text(strip=True):
+            refs_div.extract()
+        if entries:
+            rewriter.set_modified(section)
+
+    def matches(self, anchor):
+        href = anchor['href']
+        fragment = _split_href(href)[1]
+        # external links, e.g. doi.org, are not citations of our bibliography
+        if not _is_internal_href(href) or not fragment:
+            return False
+        if anchor.get('role') == CITATION_ANCHOR_ROLE:
+            return True
+        return fragment.startswith(CITATION_ID_PREFIX)
+
+    def rewrite(self, anchor, section, rewriter):
+        rewriter.add_link(anchor, section,
+                          target_id=_split_href(anchor['href'])[1],
+                          target_section=self.bibliography_chapter)
+
+    def finish(self, rewriter):
+        if not self._entries:
+            return
+        bibliography_chapter = self.bibliography_chapter
+        soup = rewriter.get_soup(bibliography_chapter)
+
+        refs_div = soup.find(id=BIBLIOGRAPHY_DIV_ID)
+        if refs_div is None:
+            refs_div = soup.new_tag('div', id=BIBLIOGRAPHY_DIV_ID)
+            _get_the_h1(soup).insert_after(refs_div)
+
+        present_ids = {tag['id'] for tag in refs_div.find_all(id=True)}
+        for entry in self._entries:
+            entry_id = entry.get('id')
+            if entry_id in present_ids:
                 continue
+            refs_div.append(entry)
+            present_ids.add(entry_id)
+            if entry_id is not None:
+                rewriter.register_id(entry_id, bibliography_chapter)
+        rewriter.set_modified(bibliography_chapter)
+
+
+class AnchorRewriter:
+    # Every section is parsed once, the rules are applied to it and its ids
+    # are stored in a global map. The hrefs are only written once all sections
+    # have been processed because the targets might be moved by any rule.
+
+    def __init__(self, epub, rules):
+        self.epub = epub
+        self.rules = rules
+        self._soups = {}
+        self._modified_sections = set()
+        self._section_ids = {}
+        self._global_id_map = {}
+        self._links = []
+        self._relocated_anchors = {}
+        self._sections_by_path = {section.absolute_path: section
+                                  for section in epub.sections}
+
+    def get_soup(self, section):
+        return self._soups[section]
+
+    def set_modified(self, section):
+        self._modified_sections.add(section)
+
+    def register_id(self, id, section):
+        self._section_ids.setdefault(section, set()).add(id)
+        self._global_id_map.setdefault(id, section)
+
+    def add_link(self, anchor, section, target_id, target_section=None):
+        located_in = self._relocated_anchors.get(id(anchor), section)
+        self._links.append({'anchor': anchor,
+                            'section': section,
+                            'located_in': located_in,
+                            'target_id': target_id,
+                            'target_section': target_section})
+
+    def relocate(self, element, from_section, to_section):
+        # the anchors of an element moved to another section are processed
+        # as if they were in their original section, but their hrefs are
+        # written relative to the new one
+        for anchor in element.find_all('a', href=True):
+            self._relocated_anchors[id(anchor)] = to_section
+            self._process_anchor(anchor, from_section)
+
+    def _get_linked_section(self, href, section):
+        path = _split_href(href)[0]
+        if not path:
+            return section
+        dir_path = posixpath.dirname(section.absolute_path)
+        path = posixpath.normpath(posixpath.join(dir_path, path))
+        return self._sections_by_path.get(path)
+
+    def _process_section(self, section):
+        soup = BeautifulSoup(section.data, "lxml")
+        self._soups[section] = soup
+
+        for rule in self.rules:
+            rule.prepare_section(soup, section, self)
+
+        for tag in soup.find_all(id=True):
+            self.register_id(tag['id'], section)
+
+        for anchor in soup.find_all('a', href=True):
+            self._process_anchor(anchor, section)
+
+    def _process_anchor(self, anchor, section):
+        for rule in self.rules:
+            if rule.matches(anchor):
+                rule.rewrite(anchor, section, self)
+                return
+
+        href = anchor['href']
+        target_id = _split_href(href)[1]
+        if _is_internal_href(href) and target_id:
+            # cross references, only fixed if the target or the anchor have moved
+            self.add_link(anchor, section, target_id=target_id)
+
+    def _resolve_link(self, link):
+        anchor = link['anchor']
+        section = link['section']
+        located_in = link['located_in']
+        target_id = link['target_id']
+        target_section = link['target_section']
+
+        if target_section is None:
+            linked_section = self._get_linked_section(anchor['href'], section)
+            if target_id in self._section_ids.get(linked_section, set()):
+                if located_in is section:
+                    return
+                target_section = linked_section
+            else:
+                target_section = self._global_id_map.get(target_id)
+            if target_section is None:
+                return
 
-            path_to_notes_chapter = notes_chapter.path_from(chapter)
-            chapter_footnotes_info, global_footnote_count = chapter.modify_footnote_links(global_footnote_count,
-                                                                                          path_to_notes_chapter)
-            chapters_with_footnotes.append({'chapter': chapter,
-                                            'footnotes': chapter_footnotes,
-                                            'info_about_footnotes_in_chapter': chapter_footnotes_info})
-        self._appennd_notes(notes_chapter, chapters_with_footnotes)
+        new_href = target_section.path_from(located_in) + '#' + target_id
+        if anchor['href'] != new_href:
+            anchor['href'] = new_href
+            self.set_modified(located_in)
+
+    def run(self):
+        for section in self.epub.sections:
+            self._process_section(section)
+
+        for rule in self.rules:
+            rule.finish(self)
+
+        for link in self._links:
+            self._resolve_link(link)
+
+        for section in self._modified_sections:
+            section.data = _serialize_soup(self._soups[section],
+                                           pretty=section.pretty)
 
 
 def move_notes_from_each_chapter_to_notes_chapter(in_epub_path, out_epub_path,
                                                   bibliography_chapter_id,
-                                                  notes_chapter_id):
+                                                  notes_chapter_id,
+                                                  pretty_html=True,
+                                                  minify=False):
     epub = Epub(in_epub_path,
                 bibliography_chapter_id=bibliography_chapter_id,
-                notes_chapter_id=notes_chapter_id)
-    epub.collect_footnotes_in_footnotes_chapter()
+                notes_chapter_id=notes_chapter_id,
+                pretty_html=pretty_html)
+    epub.rewrite_anchors()
+    if minify:
+        epub.minify()
+    epub.write(out_epub_path)
+
+
+def subset_epub_fonts(in_epub_path, out_epub_path, cache_path=None):
+    epub = _Epub(in_epub_path)
+    epub.subset_fonts(cache_path=cache_path)
     epub.write(out_epub_path)
 
 
 if __name__ == '__main__':
     import sys
+    try:
+        from rich import print
+    except ImportError:
+        pass
     argv = sys.argv
     if len(argv) != 3:
         print(f'Usage: {__file__} in_epub out_epub')
@@ -0,0 +1,41 @@
+import os
+import re
+import subprocess
+import sys
+
+import pytest
+
+from ebook_building.cli import main
+
+STARTUP_TIME_BUDGET_US = 50000
+HEAVY_MODULES = ("bs4", "lxml", "ruamel", "fontTools", "rich")
+
+
+def _measure_import_times(module):
+    cmd = [sys.executable, "-X", "importtime", "-c", f"import {module}"]
+    # the subprocess should find the same ebook_building than the tests
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(sys.path)}
+    process = subprocess.run(cmd, capture_output=True, check=True, env=env)
+
+    cumulative_times = {}
+    for line in process.stderr.decode().splitlines():
+        match = re.match(r"import time:\s+\d+\s+\|\s+(\d+)\s+\|\s*(\S+)", line)
+        if match:
+            cumulative_times[match.group(2)] = int(match.group(1))
+    return cumulative_times
+
+
+def test_startup_time():
+    import_times = _measure_import_times("ebook_building.cli")
+
+    assert import_times["ebook_building.cli"] < STARTUP_TIME_BUDGET_US
+    heavy_modules = [
+        module for module in import_times if module.split(".")[0] in HEAVY_MODULES
+    ]
+    assert not heavy_modules
+
+
+def test_convert_unknown_format(tmp_path, capsys):
+    with pytest.raises(SystemExit):
+        main(["convert", str(tmp_path / "book.epub"), str(tmp_path / "book.txt")])
+    assert "unknown output format" in capsys.readouterr().err
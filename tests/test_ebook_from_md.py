@@ -0,0 +1,40 @@
+import os
+
+from ebook_building.ebook_from_md import _sync_dir
+
+
+def test_sync_dir(tmp_path):
+    src_dir = tmp_path / "src"
+    dst_dir = tmp_path / "dst"
+    linked_dir = tmp_path / "linked"
+    linked_dir.mkdir()
+    (linked_dir / "linked.md").write_text("linked")
+    src_dir.mkdir()
+    (src_dir / "chapter.md").write_text("chapter")
+    (src_dir / "removed.md").write_text("removed")
+    (src_dir / "to_file").mkdir()
+    (src_dir / "to_file" / "a.md").write_text("a")
+    os.symlink(linked_dir, src_dir / "link")
+
+    _sync_dir(src_dir, dst_dir)
+    assert (dst_dir / "link" / "linked.md").read_text() == "linked"
+
+    (dst_dir / "generated.md").write_text("generated")
+    (src_dir / "removed.md").unlink()
+    (src_dir / "to_file" / "a.md").unlink()
+    (src_dir / "to_file").rmdir()
+    (src_dir / "to_file").write_text("file")
+    (src_dir / "chapter.md").unlink()
+    (src_dir / "chapter.md").mkdir()
+
+    _sync_dir(src_dir, dst_dir, paths_to_keep=[dst_dir / "generated.md"])
+    paths = {
+        str(path.relative_to(dst_dir)): path.is_dir() for path in dst_dir.rglob("*")
+    }
+    assert paths == {
+        "chapter.md": True,
+        "generated.md": False,
+        "link": True,
+        "link/linked.md": False,
+        "to_file": False,
+    }
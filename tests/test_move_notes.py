@@ -0,0 +1,116 @@
+from pathlib import Path
+import zipfile
+
+from bs4 import BeautifulSoup
+
+from ebook_building.move_notes import (_get_css_text_characters, _minify_css,
+                                      _minify_html_soup,
+                                      move_notes_from_each_chapter_to_notes_chapter)
+
+
+def test_css_text_characters():
+    css = '''q {quotes: "\\201C" "\\201D"}
+             li::before {content: "\\2192 " "x"; color: red}
+             p {font-family: "Foo"}
+             /* content: "ignored" */'''
+    assert _get_css_text_characters(css) == {'“', '”', '→', 'x'}
+
+
+def test_minify_css_keeps_strings_and_urls():
+    css = '''/* comment */
+             p , li > em {
+               font-family : "Foo , Bar" , serif ;
+               background: url( "a ; b.png" );
+             }
+             li::before {content: " > /* not a comment */ "}
+             h1 {margin:1px/**/2px}'''
+    expected = ('p,li>em{font-family:"Foo , Bar",serif;background:url( "a ; b.png" )}'
+                'li::before{content:" > /* not a comment */ "}h1{margin:1px 2px}')
+    assert _minify_css(css) == expected
+
+
+def test_minify_html_keeps_non_breaking_spaces():
+    html = ('<html><body>\n  <p>10\xa0kg  and\n 5 g</p>\n'
+            '  <p>\xa0</p>\n  <pre>a\n   b</pre>\n'
+            '  <p>Old <del>a</del>\n <del>b</del> text</p>\n</body></html>')
+    soup = BeautifulSoup(html, 'lxml')
+    _minify_html_soup(soup)
+    assert str(soup) == ('<html><body><p>10\xa0kg and 5 g</p>'
+                         '<p>\xa0</p><pre>a\n   b</pre>'
+                         '<p>Old <del>a</del> <del>b</del> text</p></body></html>')
+
+
+SECTION_TEMPLATE = '''<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE html>
+<html xmlns="http://www.w3.org/1999/xhtml"><head><title>{id}</title></head>
+<body><section id="{id}" class="level1"><h1>{title}</h1>
+{body}
+</section></body></html>'''
+
+
+def _create_epub(path, sections):
+    with zipfile.ZipFile(path, 'w') as zip_file:
+        zip_file.writestr('mimetype', 'application/epub+zip')
+        for fname, (id, title, body) in sections.items():
+            zip_file.writestr(f'EPUB/text/{fname}',
+                              SECTION_TEMPLATE.format(id=id, title=title, body=body))
+
+
+def _read_sections(path):
+    with zipfile.ZipFile(path, 'r') as zip_file:
+        return {Path(name).name: BeautifulSoup(zip_file.read(name), 'lxml')
+                for name in zip_file.namelist() if name.endswith('.xhtml')}
+
+
+def test_move_notes_and_bibliography(tmp_path):
+    chapter = '''<p id="intro">Text<a href="#fn1" class="footnote-ref" id="fnref1">1</a></p>
+<div id="refs" class="references csl-bib-body">
+<div id="ref-doe" class="csl-entry">Doe, J. A book.</div>
+</div>
+<section class="footnotes footnotes-end-of-document" role="doc-endnotes"><ol>
+<li id="fn1"><p>See <a href="#ref-doe" role="doc-biblioref">Doe</a>
+and <a href="#intro">the intro</a>.<a href="#fnref1" class="footnote-back">↩</a></p></li>
+</ol></section>'''
+    in_path = tmp_path / 'in.epub'
+    out_path = tmp_path / 'out.epub'
+    _create_epub(in_path, {'ch1.xhtml': ('chapter-one', 'Chapter one', chapter),
+                           'notas.xhtml': ('notas', 'Notas', ''),
+                           'biblio.xhtml': ('bibliografia', 'Bibliografía', '')})
+    move_notes_from_each_chapter_to_notes_chapter(in_path, out_path,
+                                                  bibliography_chapter_id='bibliografia',
+                                                  notes_chapter_id='notas')
+    sections = _read_sections(out_path)
+
+    chapter = sections['ch1.xhtml']
+    assert chapter.find(class_='footnotes') is None
+    assert chapter.find(class_='csl-entry') is None
+    assert chapter.find('a', class_='footnote-ref')['href'] == '../text/notas.xhtml#fn1'
+
+    notes = sections['notas.xhtml']
+    assert notes.h2.get_text(strip=True) == 'Chapter one'
+    assert notes.find('li')['id'] == 'fn1'
+    hrefs = [anchor['href'] for anchor in notes.find('li').find_all('a')]
+    assert hrefs == ['../text/biblio.xhtml#ref-doe', '../text/ch1.xhtml#intro',
+                     '../text/ch1.xhtml#fnref1']
+
+    assert sections['biblio.xhtml'].find(id='ref-doe') is not None
+
+
+def test_citations_only_rewrite_internal_links(tmp_path):
+    chapter = '''<p><a href="https://doi.org/10.1/abc#ref-3">doi</a>
+<a href="mailto:a@b.c#ref-x">mail</a>
+<a href="biblio.xhtml" role="doc-biblioref">no fragment</a>
+<a href="#ref-doe" role="doc-biblioref">Doe</a></p>'''
+    in_path = tmp_path / 'in.epub'
+    out_path = tmp_path / 'out.epub'
+    _create_epub(in_path, {'ch1.xhtml': ('chapter-one', 'Chapter one', chapter),
+                           'notas.xhtml': ('notas', 'Notas', ''),
+                           'biblio.xhtml': ('bibliografia', 'Bibliografía',
+                                            '<div id="refs"><div id="ref-doe" class="csl-entry">Doe</div></div>')})
+    move_notes_from_each_chapter_to_notes_chapter(in_path, out_path,
+                                                  bibliography_chapter_id='bibliografia',
+                                                  notes_chapter_id='notas')
+    chapter = _read_sections(out_path)['ch1.xhtml']
+    hrefs = [anchor['href'] for anchor in chapter.find_all('a')]
+    assert hrefs == ['https://doi.org/10.1/abc#ref-3', 'mailto:a@b.c#ref-x',
+                     'biblio.xhtml', '../text/biblio.xhtml#ref-doe']